@@ -5,31 +5,67 @@ Enables Claude to create visual images using DALL-E 3
 """
 
 import os
-import json
-from typing import Optional, Dict, Any
-from openai import OpenAI
+import base64
+import shutil
+import hashlib
+import uuid
+import functools
+import re
+import time
+import random
+import asyncio
+import tempfile
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Optional, Dict, Any, AsyncIterator, Tuple, List
+from openai import AsyncOpenAI, AuthenticationError, RateLimitError, APIConnectionError, InternalServerError
 from mcp.server.fastmcp import FastMCP
+import orjson
 from dotenv import load_dotenv
 import httpx
 from datetime import datetime
 from pathlib import Path
 
-# Load .env file - first try project root, then local
 script_dir = os.path.dirname(os.path.abspath(__file__))
-project_root = os.path.abspath(os.path.join(script_dir, '../../..'))
-root_env = os.path.join(project_root, '.env')
-local_env = os.path.join(script_dir, '.env')
+project_root = Path(os.path.abspath(os.path.join(script_dir, '../../..')))
 
-if os.path.exists(root_env):
-    load_dotenv(root_env)
-elif os.path.exists(local_env):
-    load_dotenv(local_env)
+# Shared HTTP client for image downloads - created on first use so
+# keep-alive connections survive between saves
+_HTTP: Optional[httpx.AsyncClient] = None
+
+def _get_http() -> httpx.AsyncClient:
+    """Return the shared download client, creating it on first use"""
+    global _HTTP
+    if _HTTP is None:
+        _HTTP = httpx.AsyncClient(
+            http2=True,
+            timeout=httpx.Timeout(30.0),
+            limits=httpx.Limits(max_keepalive_connections=20)
+        )
+    return _HTTP
+
+@asynccontextmanager
+async def lifespan(server: FastMCP) -> AsyncIterator[None]:
+    """Close the shared download client when the server shuts down"""
+    global _HTTP
+    try:
+        yield
+    finally:
+        if _HTTP is not None:
+            await _HTTP.aclose()
+            _HTTP = None
 
 # Initialize MCP server
-mcp = FastMCP("openai-images")
+mcp = FastMCP("openai-images", lifespan=lifespan)
 
 # Default save location - in takuma-os local directory (gitignored)
-DEFAULT_SAVE_PATH = os.path.join(project_root, 'local', 'generated-images')
+DEFAULT_SAVE_DIR = project_root / 'local' / 'generated-images'
+
+# Cache of previously generated images, keyed by generation parameters.
+# Least recently used entries are evicted past OPENAI_IMAGES_CACHE_MB.
+CACHE_DIR = project_root / 'local' / 'image-cache'
+DEFAULT_CACHE_MB = 500
 
 # Get credentials from environment or saved file
 def load_credentials() -> Dict[str, str]:
@@ -42,15 +78,526 @@ def load_credentials() -> Dict[str, str]:
         # First try local credentials file
         local_creds = os.path.join(os.path.dirname(__file__), 'credentials.json')
         if os.path.exists(local_creds):
-            with open(local_creds, 'r') as f:
-                creds = json.load(f)
+            with open(local_creds, 'rb') as f:
+                creds = orjson.loads(f.read())
                 api_key = creds.get('api_key')
     
     return {
         'api_key': api_key
     }
 
-CREDS = load_credentials()
+@functools.lru_cache(maxsize=1)
+def _creds() -> Dict[str, str]:
+    """Load .env and credentials once, on first use rather than at import"""
+    # Load .env file - first try project root, then local
+    root_env = os.path.join(project_root, '.env')
+    local_env = os.path.join(script_dir, '.env')
+    
+    if os.path.exists(root_env):
+        load_dotenv(root_env)
+    elif os.path.exists(local_env):
+        load_dotenv(local_env)
+    
+    return load_credentials()
+
+# Shared OpenAI client - created on first use so its connection pool is reused
+_CLIENT: Optional[AsyncOpenAI] = None
+
+def _get_client() -> AsyncOpenAI:
+    """Return the shared OpenAI client, creating it on first use"""
+    global _CLIENT
+    if _CLIENT is None:
+        # SDK retries are disabled; _images_generate owns the retry policy
+        _CLIENT = AsyncOpenAI(api_key=_creds()['api_key'], max_retries=0)
+    return _CLIENT
+
+# Client-side rate limits, shaped before requests reach OpenAI.
+# Override with OPENAI_IMAGES_RPM / OPENAI_IMAGES_TPM to match your account tier.
+DEFAULT_RPM = 50
+DEFAULT_TPM = 100000
+# Rough token cost of one generated image, on top of the prompt
+ESTIMATED_IMAGE_TOKENS = 1000
+# Start shaping harder once less than this fraction of the server window remains
+RATE_LIMIT_LOW_WATER = 0.1
+
+class _TokenBucket:
+    """Async token bucket that refills continuously up to its capacity"""
+    
+    def __init__(self, capacity: float, period: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = max(0.0, now - max(self._updated, self._paused_until))
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+    
+    async def acquire(self, amount: float = 1.0) -> None:
+        """Wait until `amount` tokens are available, then take them"""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                paused_for = max(0.0, self._paused_until - time.monotonic())
+                await asyncio.sleep(paused_for + (amount - self._tokens) / self.rate)
+    
+    def shrink(self, remaining: float, reset_seconds: float) -> None:
+        """Allow at most `remaining` tokens until the server window resets"""
+        self._refill()
+        self._tokens = min(self._tokens, remaining)
+        self._paused_until = max(self._paused_until, time.monotonic() + reset_seconds)
+
+_REQUEST_BUCKET: Optional[_TokenBucket] = None
+_TOKEN_BUCKET: Optional[_TokenBucket] = None
+
+def _get_buckets() -> Tuple[_TokenBucket, _TokenBucket]:
+    """Return the shared request and token buckets, creating them on first use"""
+    global _REQUEST_BUCKET, _TOKEN_BUCKET
+    if _REQUEST_BUCKET is None:
+        _REQUEST_BUCKET = _TokenBucket(float(os.getenv('OPENAI_IMAGES_RPM', DEFAULT_RPM)))
+        _TOKEN_BUCKET = _TokenBucket(float(os.getenv('OPENAI_IMAGES_TPM', DEFAULT_TPM)))
+    return _REQUEST_BUCKET, _TOKEN_BUCKET
+
+def _parse_reset(value: str) -> float:
+    """Parse an x-ratelimit-reset-* duration such as "6m0s" or "20ms" into seconds"""
+    units = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+    return sum(
+        float(amount) * units[unit]
+        for amount, unit in re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    )
+
+def _observe_rate_limits(headers: httpx.Headers) -> None:
+    """Shrink the local buckets when OpenAI reports its window is nearly used up"""
+    request_bucket, token_bucket = _get_buckets()
+    for bucket, kind in ((request_bucket, 'requests'), (token_bucket, 'tokens')):
+        try:
+            limit = float(headers[f'x-ratelimit-limit-{kind}'])
+            remaining = float(headers[f'x-ratelimit-remaining-{kind}'])
+            reset_seconds = _parse_reset(headers.get(f'x-ratelimit-reset-{kind}', ''))
+        except (KeyError, ValueError):
+            continue
+        if remaining < limit * RATE_LIMIT_LOW_WATER:
+            bucket.shrink(remaining, reset_seconds)
+
+# Retry policy for transient OpenAI failures (rate limits, 5xx, network)
+MAX_GENERATE_ATTEMPTS = 6
+BACKOFF_MIN_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+
+def _retry_after(error: Exception) -> Optional[float]:
+    """Read the server-suggested wait in seconds from an API error, if any"""
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        if 'retry-after-ms' in response.headers:
+            return float(response.headers['retry-after-ms']) / 1000
+        if 'retry-after' in response.headers:
+            return float(response.headers['retry-after'])
+    except ValueError:
+        # HTTP-date form or garbage - fall back to exponential backoff
+        return None
+    return None
+
+# Adaptive concurrency for images.generate: additive increase while latency
+# stays on target, multiplicative decrease on 429/5xx
+CONCURRENCY_INITIAL = 4
+CONCURRENCY_MIN = 1
+CONCURRENCY_MAX = 32
+CONCURRENCY_INCREASE = 0.5
+CONCURRENCY_DECREASE = 0.5
+LATENCY_WINDOW = 20
+TARGET_LATENCY_SECONDS = 30.0
+
+class _AdaptiveConcurrency:
+    """AIMD-sized concurrency limit with a circuit breaker that pauses all calls after throttling"""
+    
+    def __init__(self):
+        self.limit = float(CONCURRENCY_INITIAL)
+        self._in_flight = 0
+        self._latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self._open_until = 0.0
+        self._changed = asyncio.Event()
+    
+    async def acquire(self) -> None:
+        """Wait for the breaker to close and a free slot under the current limit"""
+        while True:
+            paused_for = self._open_until - time.monotonic()
+            if paused_for <= 0 and self._in_flight < int(self.limit):
+                self._in_flight += 1
+                return
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), paused_for if paused_for > 0 else None)
+            except asyncio.TimeoutError:
+                pass
+    
+    def release(self, latency: Optional[float] = None, throttled: bool = False,
+                pause: Optional[float] = None) -> None:
+        """Free a slot and adjust the limit from the call's outcome"""
+        self._in_flight -= 1
+        if throttled:
+            self.limit = max(CONCURRENCY_MIN, self.limit * CONCURRENCY_DECREASE)
+            self._latencies.clear()
+            # Trip the breaker so queued calls don't pile onto a throttled API
+            pause = min(BACKOFF_MAX_SECONDS, pause or BACKOFF_MIN_SECONDS)
+            self._open_until = max(self._open_until, time.monotonic() + pause)
+        elif latency is not None:
+            self._latencies.append(latency)
+            if sum(self._latencies) / len(self._latencies) <= TARGET_LATENCY_SECONDS:
+                self.limit = min(CONCURRENCY_MAX, self.limit + CONCURRENCY_INCREASE)
+        self._changed.set()
+
+_CONCURRENCY: Optional[_AdaptiveConcurrency] = None
+
+def _get_concurrency() -> _AdaptiveConcurrency:
+    """Return the shared concurrency controller, creating it on first use"""
+    global _CONCURRENCY
+    if _CONCURRENCY is None:
+        _CONCURRENCY = _AdaptiveConcurrency()
+    return _CONCURRENCY
+
+async def _images_generate(**kwargs: Any) -> Any:
+    """Call images.generate, retrying transient failures with exponential backoff and jitter"""
+    client = _get_client()
+    request_bucket, token_bucket = _get_buckets()
+    concurrency = _get_concurrency()
+    estimated_tokens = len(kwargs.get('prompt', '')) / 4 + ESTIMATED_IMAGE_TOKENS
+    for attempt in range(1, MAX_GENERATE_ATTEMPTS + 1):
+        # Rejected requests still count against quota, so shape every attempt
+        await request_bucket.acquire()
+        await token_bucket.acquire(estimated_tokens)
+        await concurrency.acquire()
+        started = time.monotonic()
+        try:
+            raw = await client.images.with_raw_response.generate(**kwargs)
+        except (RateLimitError, APIConnectionError, InternalServerError) as e:
+            quota_exhausted = getattr(e, 'code', None) == 'insufficient_quota'
+            delay = _retry_after(e)
+            # 429s and 5xx mean the API is overloaded; network errors say nothing about capacity
+            concurrency.release(
+                throttled=not quota_exhausted and not isinstance(e, APIConnectionError),
+                pause=delay
+            )
+            if getattr(e, 'response', None) is not None:
+                _observe_rate_limits(e.response.headers)
+            # Exhausted quota won't recover by waiting
+            if attempt == MAX_GENERATE_ATTEMPTS or quota_exhausted:
+                raise
+            # Honour the server's Retry-After as given; only the fallback is clamped
+            if delay is None:
+                delay = max(
+                    BACKOFF_MIN_SECONDS,
+                    random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_MIN_SECONDS * 2 ** attempt))
+                )
+            await asyncio.sleep(delay)
+            continue
+        except BaseException:
+            concurrency.release()
+            raise
+        
+        concurrency.release(latency=time.monotonic() - started)
+        _observe_rate_limits(raw.headers)
+        return raw.parse()
+
+# Accepted parameter values, in the order shown in error messages
+SIZES = ("1024x1024", "1792x1024", "1024x1792")
+QUALITIES = ("standard", "hd")
+STYLES = ("vivid", "natural")
+MAX_PROMPT_LENGTH = 4000
+
+VALID_SIZES = frozenset(SIZES)
+VALID_QUALITIES = frozenset(QUALITIES)
+VALID_STYLES = frozenset(STYLES)
+
+# Validation error results are built once; they are returned as-is and never mutated
+MISSING_CREDENTIALS_ERROR = {
+    "success": False,
+    "error": "Missing OpenAI API credentials. Please set OPENAI_API_KEY environment variable."
+}
+INVALID_SIZE_ERROR = {
+    "success": False,
+    "error": f"Invalid size. Must be one of: {', '.join(SIZES)}"
+}
+INVALID_QUALITY_ERROR = {
+    "success": False,
+    "error": f"Invalid quality. Must be one of: {', '.join(QUALITIES)}"
+}
+INVALID_STYLE_ERROR = {
+    "success": False,
+    "error": f"Invalid style. Must be one of: {', '.join(STYLES)}"
+}
+PROMPT_TOO_LONG_ERROR = {
+    "success": False,
+    "error": f"Prompt too long. Maximum {MAX_PROMPT_LENGTH} characters for DALL-E 3."
+}
+
+# Accepted values and error result for each validated parameter
+PARAMETER_VALIDATORS = {
+    "size": (VALID_SIZES, INVALID_SIZE_ERROR),
+    "quality": (VALID_QUALITIES, INVALID_QUALITY_ERROR),
+    "style": (VALID_STYLES, INVALID_STYLE_ERROR)
+}
+
+def _validate_request(
+    prompt: str,
+    size: Optional[str],
+    quality: Optional[str],
+    style: Optional[str]
+) -> Optional[Dict[str, Any]]:
+    """Return an error result if credentials or parameters are invalid, otherwise None"""
+    
+    if not _creds().get('api_key'):
+        return MISSING_CREDENTIALS_ERROR
+    
+    # Validate parameters in a single pass
+    for name, value in (("size", size), ("quality", quality), ("style", style)):
+        valid_values, error = PARAMETER_VALIDATORS[name]
+        if value not in valid_values:
+            return error
+    
+    if len(prompt) > MAX_PROMPT_LENGTH:
+        return PROMPT_TOO_LONG_ERROR
+    
+    return None
+
+def _generation_error(e: Exception) -> Dict[str, Any]:
+    """Translate an image generation failure into a helpful error result"""
+    
+    # Provide helpful error messages
+    if isinstance(e, AuthenticationError):
+        return {
+            "success": False,
+            "error": "API key authentication failed. Please check your OpenAI API key."
+        }
+    elif isinstance(e, RateLimitError):
+        if e.code == 'insufficient_quota':
+            return {
+                "success": False,
+                "error": "API quota exceeded. Please check your OpenAI account billing."
+            }
+        return {
+            "success": False,
+            "error": "Rate limit exceeded. Please wait before trying again."
+        }
+    else:
+        return {
+            "success": False,
+            "error": f"Failed to generate image: {e}"
+        }
+
+def _resolve_file_path(filename: Optional[str], save_path: Optional[str]) -> Path:
+    """Build the full .png path for a save, creating the directory if needed"""
+    # Determine save directory
+    if save_path:
+        # Use provided path relative to project root if not absolute
+        save_dir = Path(save_path)
+        if not save_dir.is_absolute():
+            save_dir = project_root / save_dir
+    else:
+        # Use default location
+        save_dir = DEFAULT_SAVE_DIR
+    
+    # Create directory if it doesn't exist
+    save_dir.mkdir(parents=True, exist_ok=True)
+    
+    # Generate filename if not provided
+    if not filename:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"dalle_image_{timestamp}"
+    
+    # Ensure filename doesn't have extension (we'll add .png)
+    if filename.endswith(('.png', '.jpg', '.jpeg')):
+        filename = filename.rsplit('.', 1)[0]
+    
+    return save_dir / f"{filename}.png"
+
+def _write_bytes(file_path: Path, data: bytes) -> None:
+    """Write bytes to a file (blocking - run via asyncio.to_thread)"""
+    with open(file_path, 'wb') as f:
+        f.write(data)
+
+def _write_bytes_atomic(file_path: Path, data: bytes) -> None:
+    """Write bytes to a unique temp file beside `file_path`, then move it into place"""
+    fd, temp_path = tempfile.mkstemp(dir=file_path.parent, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+def _copy_file(source: Path, destination: Path) -> int:
+    """Copy a file and return its size (blocking - run via asyncio.to_thread)"""
+    shutil.copyfile(source, destination)
+    return destination.stat().st_size
+
+def _saved_result(file_path: Path, size_bytes: int) -> Dict[str, Any]:
+    """Describe a saved image file"""
+    # Get relative path from project root for cleaner display
+    relative_path = os.path.relpath(file_path, project_root)
+    
+    return {
+        "success": True,
+        "file_path": str(file_path),
+        "relative_path": relative_path,
+        "filename": file_path.name,
+        "size_bytes": size_bytes,
+        "message": f"Image saved successfully to {relative_path}"
+    }
+
+async def _generate_image_bytes(
+    prompt: str,
+    size: str,
+    quality: str,
+    style: str,
+    model: str
+) -> Tuple[bytes, Optional[str]]:
+    """Generate an image and return its decoded bytes and revised prompt"""
+    # Request the image inline so no second download from the CDN is needed
+    response = await _images_generate(
+        model=model,
+        prompt=prompt,
+        n=1,
+        size=size,
+        quality=quality,
+        style=style,
+        response_format="b64_json"
+    )
+    
+    image_data = response.data[0]
+    return base64.b64decode(image_data.b64_json), image_data.revised_prompt
+
+async def _generate_and_cache(
+    key: str,
+    prompt: str,
+    size: str,
+    quality: str,
+    style: str,
+    model: str
+) -> Tuple[bytes, Optional[str]]:
+    """Generate an image and store it in the cache before returning it"""
+    image_bytes, revised_prompt = await _generate_image_bytes(prompt, size, quality, style, model)
+    await asyncio.to_thread(_cache_store, key, image_bytes, revised_prompt)
+    return image_bytes, revised_prompt
+
+# Generations currently in flight, keyed like the image cache, so concurrent
+# identical requests share a single API call
+_INFLIGHT: Dict[str, "asyncio.Task[Tuple[bytes, Optional[str]]]"] = {}
+
+def _forget_inflight(key: str, task: "asyncio.Task[Tuple[bytes, Optional[str]]]") -> None:
+    """Drop a finished generation from the in-flight map"""
+    _INFLIGHT.pop(key, None)
+    # Retrieve any failure so one nobody waited for isn't logged as unhandled
+    if not task.cancelled():
+        task.exception()
+
+async def _generate_image_bytes_shared(
+    key: str,
+    prompt: str,
+    size: str,
+    quality: str,
+    style: str,
+    model: str
+) -> Tuple[bytes, Optional[str]]:
+    """Generate image bytes, joining an identical generation already in flight"""
+    task = _INFLIGHT.get(key)
+    if task is None:
+        # The task writes the cache itself, so the image is kept even if every caller goes away
+        task = asyncio.create_task(_generate_and_cache(key, prompt, size, quality, style, model))
+        _INFLIGHT[key] = task
+        task.add_done_callback(lambda done: _forget_inflight(key, done))
+    # Shield so one caller giving up doesn't cancel the call for the others
+    return await asyncio.shield(task)
+
+def _cache_key(prompt: str, size: str, quality: str, style: str, model: str) -> str:
+    """Stable cache key for a set of generation parameters"""
+    payload = orjson.dumps([prompt, size, quality, style, model])
+    return hashlib.blake2b(payload).hexdigest()
+
+# Serialises cache writers (they run in worker threads) so an entry's image
+# and metadata always come from the same generation
+_CACHE_LOCK = threading.Lock()
+
+def _cache_lookup(key: str) -> Optional[Tuple[Path, Optional[str]]]:
+    """Return the cached image path and revised prompt for a key, if present"""
+    image_path = CACHE_DIR / f"{key}.png"
+    try:
+        with open(CACHE_DIR / f"{key}.json", 'rb') as f:
+            metadata = orjson.loads(f.read())
+        # Mark the entry as used explicitly so eviction also works on noatime mounts
+        os.utime(image_path)
+    except (OSError, ValueError):
+        return None
+    return image_path, metadata.get('revised_prompt')
+
+def _restore_from_cache(
+    key: str,
+    filename: Optional[str],
+    save_path: Optional[str]
+) -> Optional[Tuple[Path, int, Optional[str]]]:
+    """Copy a cached image to its save location, returning (path, size, revised prompt) or None on a miss"""
+    cached = _cache_lookup(key)
+    if cached is None:
+        return None
+    cached_path, revised_prompt = cached
+    file_path = _resolve_file_path(filename, save_path)
+    try:
+        size_bytes = _copy_file(cached_path, file_path)
+    except FileNotFoundError as e:
+        # Evicted between the lookup and the copy - treat it as a miss
+        if e.filename is not None and Path(e.filename) == cached_path:
+            return None
+        raise
+    return file_path, size_bytes, revised_prompt
+
+def _cache_store(key: str, image_bytes: bytes, revised_prompt: Optional[str]) -> None:
+    """Store a freshly generated image in the cache, evicting old entries past the size ceiling"""
+    try:
+        with _CACHE_LOCK:
+            CACHE_DIR.mkdir(parents=True, exist_ok=True)
+            # Drop the metadata first so the entry reads as a miss until both
+            # files are replaced; the metadata is written last to publish it
+            (CACHE_DIR / f"{key}.json").unlink(missing_ok=True)
+            _write_bytes_atomic(CACHE_DIR / f"{key}.png", image_bytes)
+            _write_bytes_atomic(
+                CACHE_DIR / f"{key}.json",
+                orjson.dumps({'revised_prompt': revised_prompt})
+            )
+        
+        # Evict least recently used images until the cache fits. Another store may
+        # be evicting at the same time, so entries can vanish under us.
+        max_bytes = float(os.getenv('OPENAI_IMAGES_CACHE_MB', DEFAULT_CACHE_MB)) * 1024 * 1024
+        entries = []
+        for entry in os.scandir(CACHE_DIR):
+            if not entry.name.endswith('.png'):
+                continue
+            try:
+                entries.append((entry.path, entry.stat()))
+            except FileNotFoundError:
+                continue
+        total_bytes = sum(stat.st_size for _, stat in entries)
+        for path, stat in sorted(entries, key=lambda item: item[1].st_atime):
+            if total_bytes <= max_bytes:
+                break
+            total_bytes -= stat.st_size
+            for stale_path in (os.path.splitext(path)[0] + '.json', path):
+                try:
+                    os.remove(stale_path)
+                except FileNotFoundError:
+                    pass
+    except OSError:
+        # The cache is only an optimisation - never fail a save because of it
+        pass
 
 @mcp.tool()
 async def generate_image(
@@ -74,47 +621,14 @@ async def generate_image(
         Dict with success status, image URL, and revised prompt
     """
     
-    if not CREDS.get('api_key'):
-        return {
-            "success": False,
-            "error": "Missing OpenAI API credentials. Please set OPENAI_API_KEY environment variable."
-        }
-    
-    # Validate parameters
-    valid_sizes = ["1024x1024", "1792x1024", "1024x1792"]
-    if size not in valid_sizes:
-        return {
-            "success": False,
-            "error": f"Invalid size. Must be one of: {', '.join(valid_sizes)}"
-        }
-    
-    valid_qualities = ["standard", "hd"]
-    if quality not in valid_qualities:
-        return {
-            "success": False,
-            "error": f"Invalid quality. Must be one of: {', '.join(valid_qualities)}"
-        }
-    
-    valid_styles = ["vivid", "natural"]
-    if style not in valid_styles:
-        return {
-            "success": False,
-            "error": f"Invalid style. Must be one of: {', '.join(valid_styles)}"
-        }
-    
-    if len(prompt) > 4000:
-        return {
-            "success": False,
-            "error": "Prompt too long. Maximum 4000 characters for DALL-E 3."
-        }
+    error = _validate_request(prompt, size, quality, style)
+    if error:
+        return error
     
     try:
-        # Initialize OpenAI client
-        client = OpenAI(api_key=CREDS['api_key'])
-        
-        # Generate image
+        # Generate image, retrying transient failures
         # Note: gpt-image-1 may require additional access/approval from OpenAI
-        response = client.images.generate(
+        response = await _images_generate(
             model=model,
             prompt=prompt,
             n=1,  # Most models only support n=1
@@ -140,29 +654,7 @@ async def generate_image(
         }
         
     except Exception as e:
-        error_msg = str(e)
-        
-        # Provide helpful error messages
-        if "api_key" in error_msg.lower():
-            return {
-                "success": False,
-                "error": "API key authentication failed. Please check your OpenAI API key."
-            }
-        elif "rate_limit" in error_msg.lower():
-            return {
-                "success": False,
-                "error": "Rate limit exceeded. Please wait before trying again."
-            }
-        elif "quota" in error_msg.lower():
-            return {
-                "success": False,
-                "error": "API quota exceeded. Please check your OpenAI account billing."
-            }
-        else:
-            return {
-                "success": False,
-                "error": f"Failed to generate image: {error_msg}"
-            }
+        return _generation_error(e)
 
 @mcp.tool()
 async def save_generated_image(
@@ -183,57 +675,37 @@ async def save_generated_image(
     """
     
     try:
-        # Determine save directory
-        if save_path:
-            # Use provided path relative to project root if not absolute
-            if not os.path.isabs(save_path):
-                save_dir = os.path.join(project_root, save_path)
-            else:
-                save_dir = save_path
-        else:
-            # Use default location
-            save_dir = DEFAULT_SAVE_PATH
-        
-        # Create directory if it doesn't exist
-        Path(save_dir).mkdir(parents=True, exist_ok=True)
-        
-        # Generate filename if not provided
-        if not filename:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"dalle_image_{timestamp}"
+        file_path = await asyncio.to_thread(_resolve_file_path, filename, save_path)
         
-        # Ensure filename doesn't have extension (we'll add .png)
-        if filename.endswith(('.png', '.jpg', '.jpeg')):
-            filename = os.path.splitext(filename)[0]
-        
-        # Full file path
-        file_path = os.path.join(save_dir, f"{filename}.png")
-        
-        # Download the image
-        async with httpx.AsyncClient() as client:
-            response = await client.get(image_url)
-            
+        # Stream the image to a temporary file instead of buffering it in memory,
+        # with file I/O in a worker thread so the event loop keeps serving
+        # Unique per call so concurrent saves to the same filename don't share it
+        part_path = file_path.with_name(f"{file_path.name}.{uuid.uuid4().hex}.part")
+        size_bytes = 0
+        async with _get_http().stream("GET", image_url) as response:
             if response.status_code != 200:
                 return {
                     "success": False,
                     "error": f"Failed to download image: HTTP {response.status_code}"
                 }
             
-            # Save the image
-            with open(file_path, 'wb') as f:
-                f.write(response.content)
-            
-            # Get relative path from project root for cleaner display
-            relative_path = os.path.relpath(file_path, project_root)
-            
-            return {
-                "success": True,
-                "file_path": file_path,
-                "relative_path": relative_path,
-                "filename": f"{filename}.png",
-                "size_bytes": len(response.content),
-                "message": f"Image saved successfully to {relative_path}"
-            }
+            try:
+                f = await asyncio.to_thread(open, part_path, 'xb')
+                try:
+                    async for chunk in response.aiter_bytes(65536):
+                        await asyncio.to_thread(f.write, chunk)
+                        size_bytes += len(chunk)
+                finally:
+                    await asyncio.to_thread(f.close)
+                
+                # Only replace the destination once the whole image has arrived
+                await asyncio.to_thread(os.replace, part_path, file_path)
+            except BaseException:
+                # Don't leave a truncated download behind
+                await asyncio.to_thread(part_path.unlink, missing_ok=True)
+                raise
+        
+        return _saved_result(file_path, size_bytes)
             
     except Exception as e:
         return {
@@ -249,7 +721,8 @@ async def generate_and_save_image(
     style: Optional[str] = "vivid",
     model: Optional[str] = "dall-e-3",
     filename: Optional[str] = None,
-    save_path: Optional[str] = None
+    save_path: Optional[str] = None,
+    use_cache: Optional[bool] = True
 ) -> Dict[str, Any]:
     """
     Generate an image and automatically save it locally.
@@ -263,42 +736,149 @@ async def generate_and_save_image(
         model: Model to use - "dall-e-3" (default), "dall-e-2", or "gpt-image-1" (if available)
         filename: Optional custom filename (without extension)
         save_path: Optional custom save directory
+        use_cache: Reuse an earlier image for identical parameters (default True).
+            Set to False to force a fresh variation; the cache is still refreshed
     
     Returns:
-        Dict with success status, image URL, local file path, and revised prompt
+        Dict with success status, local file path, and revised prompt
     """
     
-    # Generate the image first
-    generation_result = await generate_image(prompt, size, quality, style, model)
+    error = _validate_request(prompt, size, quality, style)
+    if error:
+        return error
     
-    if not generation_result.get('success'):
-        return generation_result
+    parameters = {
+        "size": size,
+        "quality": quality,
+        "style": style
+    }
     
-    # Save the generated image
-    save_result = await save_generated_image(
-        image_url=generation_result['image_url'],
-        filename=filename,
-        save_path=save_path
-    )
+    # Identical requests reuse the previously generated image unless a fresh one is asked for
+    cache_key = _cache_key(prompt, size, quality, style, model)
+    cached = None
+    if use_cache:
+        try:
+            cached = await asyncio.to_thread(_restore_from_cache, cache_key, filename, save_path)
+        except Exception as e:
+            return {
+                "success": False,
+                "parameters": parameters,
+                "cached": True,
+                "error": f"Cached image found but failed to save: {str(e)}"
+            }
+    
+    if cached:
+        file_path, size_bytes, revised_prompt = cached
+    else:
+        # Generate the image with its bytes inline - no separate URL download.
+        # Concurrent identical requests share one API call, unless a fresh
+        # variation was asked for.
+        try:
+            if use_cache:
+                image_bytes, revised_prompt = await _generate_image_bytes_shared(
+                    cache_key, prompt, size, quality, style, model
+                )
+            else:
+                image_bytes, revised_prompt = await _generate_and_cache(
+                    cache_key, prompt, size, quality, style, model
+                )
+        except Exception as e:
+            return _generation_error(e)
+        
+        # Write the image straight to disk, off the event loop
+        try:
+            file_path = await asyncio.to_thread(_resolve_file_path, filename, save_path)
+            await asyncio.to_thread(_write_bytes, file_path, image_bytes)
+            size_bytes = len(image_bytes)
+        except Exception as e:
+            # There is no URL to fall back on, so report the failure
+            return {
+                "success": False,
+                "revised_prompt": revised_prompt,
+                "parameters": parameters,
+                "cached": False,
+                "error": f"Image generated but failed to save: {str(e)}"
+            }
     
-    if not save_result.get('success'):
-        # Still return the generation result with save error
+    save_result = _saved_result(file_path, size_bytes)
+    
+    # Combine both results
+    return {
+        **save_result,
+        "revised_prompt": revised_prompt,
+        "parameters": parameters,
+        "cached": bool(cached),
+        "message": (
+            f"Image loaded from cache and saved to {save_result['relative_path']}"
+            if cached else
+            f"Image generated and saved to {save_result['relative_path']}"
+        )
+    }
+
+@mcp.tool()
+async def generate_images_batch(
+    prompts: List[str],
+    size: Optional[str] = "1024x1024",
+    quality: Optional[str] = "standard",
+    style: Optional[str] = "vivid",
+    model: Optional[str] = "dall-e-3",
+    max_concurrency: Optional[int] = 4
+) -> Dict[str, Any]:
+    """
+    Generate several images concurrently, one per prompt.
+    DALL-E 3 only returns one image per request, so each prompt is its own API call.
+    
+    Args:
+        prompts: List of text descriptions, one image is generated for each
+        size: Image dimensions - "1024x1024", "1792x1024", or "1024x1792"
+        quality: "standard" (faster, lower cost) or "hd" (higher quality, slower)
+        style: "vivid" (dramatic, hyper-real) or "natural" (more natural, less stylized)
+        model: Model to use - "dall-e-3" (default), "dall-e-2", or "gpt-image-1" (if available)
+        max_concurrency: Maximum number of requests in flight at once (default 4)
+    
+    Returns:
+        Dict with overall success status and one generate_image result per prompt, in order
+    """
+    
+    if not prompts:
         return {
-            **generation_result,
-            "save_error": save_result.get('error'),
-            "message": f"Image generated but failed to save: {save_result.get('error')}"
+            "success": False,
+            "error": "No prompts provided."
         }
     
-    # Combine both results
+    # Bound the fan-out so a large batch doesn't trip rate limits
+    semaphore = asyncio.Semaphore(max(1, max_concurrency or 1))
+    
+    async def generate_one(prompt: str) -> Dict[str, Any]:
+        async with semaphore:
+            return await generate_image(prompt, size, quality, style, model)
+    
+    outcomes = await asyncio.gather(
+        *(generate_one(prompt) for prompt in prompts),
+        return_exceptions=True
+    )
+    
+    results = []
+    for outcome in outcomes:
+        if isinstance(outcome, asyncio.CancelledError):
+            # One prompt's call was cancelled; report it rather than failing the batch
+            results.append({
+                "success": False,
+                "error": "Image generation was cancelled."
+            })
+        elif isinstance(outcome, Exception):
+            results.append(_generation_error(outcome))
+        elif isinstance(outcome, BaseException):
+            # KeyboardInterrupt, SystemExit and the like must still propagate
+            raise outcome
+        else:
+            results.append(outcome)
+    succeeded = sum(1 for result in results if result.get('success'))
+    
     return {
-        "success": True,
-        "image_url": generation_result['image_url'],
-        "revised_prompt": generation_result['revised_prompt'],
-        "parameters": generation_result['parameters'],
-        "file_path": save_result['file_path'],
-        "relative_path": save_result['relative_path'],
-        "filename": save_result['filename'],
-        "message": f"Image generated and saved to {save_result['relative_path']}"
+        "success": succeeded > 0,
+        "results": results,
+        "message": f"Generated {succeeded} of {len(prompts)} images. URLs will expire after 1 hour."
     }
 
 if __name__ == "__main__":